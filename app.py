@@ -1,14 +1,22 @@
-import io
+import os
 import re
 import json
+import time
+import zlib
+import uuid
+import sqlite3
+import hashlib
+import threading
 import requests
 import streamlit as st
 import openai
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.utils import ImageReader
+from pdf_export import render_story_pdf, render_story_pdf_parallel
+from ebook_export import create_epub, create_html, prepare_images
+from usage_ledger import UsageLedger
 
 # --- Konfiguracja strony ---
 st.set_page_config(page_title="Fabryka Opowiadań", page_icon="📚", layout="wide")
@@ -36,6 +44,8 @@ def init_session_state():
         
         # Dane historii
         "plan": None,
+        "plan_candidates": None,
+        "plan_variants": 1,
         "story": None,
         "scene_images": {},
         
@@ -80,7 +90,12 @@ def _ensure_cost_state():
     }.items():
         st.session_state.setdefault(k, v)
 
-def _add_chat_cost(usage):
+@st.cache_resource
+def _usage_ledger():
+    """Trwały rejestr zużycia wspólny dla wszystkich sesji procesu (zapis w tle)."""
+    return UsageLedger()
+
+def _add_chat_cost(usage, stage="chat", latency_ms=None):
     """usage: response.usage z ChatCompletion."""
     if not usage:
         return
@@ -91,14 +106,320 @@ def _add_chat_cost(usage):
     usd = (in_t/1000.0)*st.session_state.price_input_per_1k + (out_t/1000.0)*st.session_state.price_output_per_1k
     st.session_state.cost_usd += usd
     st.session_state.cost_pln = st.session_state.cost_usd * st.session_state.usd_to_pln_rate
+    _usage_ledger().record(
+        stage, model=st.session_state.get("model"), prompt_tokens=in_t, completion_tokens=out_t,
+        latency_ms=latency_ms, cost_usd=usd, session_id=_session_id()
+    )
 
-def _add_image_cost(n=1):
+def _add_image_cost(n=1, latency_ms=None):
+    usd = n * st.session_state.price_image_usd
     st.session_state.cost_images_count += n
-    st.session_state.cost_usd += n * st.session_state.price_image_usd
+    st.session_state.cost_usd += usd
     st.session_state.cost_pln = st.session_state.cost_usd * st.session_state.usd_to_pln_rate
+    _usage_ledger().record(
+        "image", model="dall-e-3", images=n, latency_ms=latency_ms, cost_usd=usd, session_id=_session_id()
+    )
 
 _ensure_cost_state()
 
+# --- Anulowanie zadań generowania (plan, opowiadanie, ilustracje) ---
+# Zmiana ustawień, wylogowanie czy kliknięcie innego przycisku przerywa zadanie
+# samym Streamlitem: nowy przebieg skryptu zgłasza przerwanie bieżącego, a ten
+# kończy się (RerunException) przy najbliższym wywołaniu st.* – w trakcie
+# strumieniowania jest to odświeżenie podglądu, przy ilustracjach st.info.
+# Token wykrywa jedynie zamkniętą sesję, której żaden nowy przebieg nie przerwie.
+class GenerationCancelled(Exception):
+    """Zadanie porzucone, bo użytkownik zamknął stronę."""
+
+
+class CancelToken:
+    """Token anulowania powiązany z sesją, dla której ruszyło zadanie."""
+
+    def __init__(self, session_id, stage):
+        self.session_id = session_id
+        self.stage = stage
+
+    @property
+    def cancelled(self):
+        return bool(self.session_id) and runtime.exists() and not runtime.get_instance().is_active_session(self.session_id)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.stage)
+
+
+def _session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def _start_job(stage):
+    return CancelToken(_session_id(), stage)
+
+def _estimate_tokens(text):
+    """Zgrubne oszacowanie liczby tokenów (~4 znaki na token)."""
+    return max(1, len(text) // 4)
+
+def _stream_chat_choices(prompt, max_tokens, temperature, token, placeholder=None, n=1):
+    """
+    Strumieniuje odpowiedź ChatCompletion (n wariantów w jednym zapytaniu) i przerywa
+    ją, gdy token zostanie anulowany. Koszt trafia do liczników także po przerwaniu –
+    wtedy zużycie jest szacowane. Wspólny prompt jest liczony raz, niezależnie od n.
+    Zwraca (lista tekstów, usage).
+    """
+    token.raise_if_cancelled()
+    started = time.perf_counter()
+    response = openai.ChatCompletion.create(
+        model=st.session_state.model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        temperature=temperature,
+        n=n,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+    parts = [[] for _ in range(n)]
+    chunks = 0
+    usage = None
+    try:
+        for chunk in response:
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices", []):
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    parts[choice.get("index", 0)].append(delta)
+                    chunks += 1
+            token.raise_if_cancelled()
+            # Odświeżenie podglądu daje też Streamlitowi okazję do przerwania przebiegu
+            if placeholder is not None and chunks and chunks % 25 == 0:
+                placeholder.markdown("".join(parts[0]))
+    finally:
+        response.close()
+        if usage is None:
+            # Strumień przerwany przed ostatnią porcją – szacujemy zużycie
+            in_t = _estimate_tokens(prompt)
+            usage = {"prompt_tokens": in_t, "completion_tokens": chunks, "total_tokens": in_t + chunks}
+        _add_chat_cost(usage, stage=token.stage, latency_ms=(time.perf_counter() - started) * 1000)
+        if placeholder is not None:
+            placeholder.empty()
+
+    return ["".join(p) for p in parts], usage
+
+def _stream_chat(prompt, max_tokens, temperature, token, placeholder=None):
+    """Jak _stream_chat_choices dla jednego wariantu. Zwraca (tekst, usage)."""
+    texts, usage = _stream_chat_choices(prompt, max_tokens, temperature, token, placeholder)
+    return texts[0], usage
+
+# --- Trwałe migawki sesji (przetrwają restart i przeniesienie na inną replikę) ---
+SNAPSHOT_DB = os.environ.get("FABRYKA_SNAPSHOT_DB", "fabryka_sessions.db")
+# Migawki porzucone bez wylogowania usuwamy po tylu dniach od ostatniej zmiany
+SNAPSHOT_TTL_DAYS = float(os.environ.get("FABRYKA_SNAPSHOT_TTL_DAYS", "30"))
+
+# Klucz API celowo NIE jest zapisywany
+SNAPSHOT_KEYS = [
+    "step", "plan", "plan_candidates", "plan_variants", "story",
+    "model", "length", "audience", "genre", "hero", "side_characters_count",
+    "side_characters_desc", "location", "want_images", "style", "num_images", "prompt",
+    "cost_prompt_tokens", "cost_completion_tokens", "cost_images_count", "cost_usd", "cost_pln",
+    "price_input_per_1k", "price_output_per_1k", "price_image_usd", "usd_to_pln_rate"
+]
+# Słowniki ilustracji – w migawce tylko skróty, same obrazy w osobnej tabeli
+SNAPSHOT_IMAGE_KEYS = ["scene_images", "story_images"]
+
+
+def _delete_orphan_images(conn, digests):
+    """Usuwa obrazy z podanych, do których nie odwołuje się już żadna migawka."""
+    conn.executemany(
+        "DELETE FROM snapshot_images WHERE digest = ? AND NOT EXISTS (SELECT 1 FROM snapshot_refs WHERE digest = ?)",
+        [(d, d) for d in digests]
+    )
+
+def _purge_snapshots(conn, session_ids):
+    """Usuwa migawki sesji razem z obrazami, których nie używa już żadna inna sesja."""
+    if not session_ids:
+        return
+    params = [(sid,) for sid in session_ids]
+    conn.execute("BEGIN")
+    try:
+        digests = set()
+        for param in params:
+            digests.update(d for (d,) in conn.execute("SELECT digest FROM snapshot_refs WHERE session_id = ?", param))
+        for table in ("snapshot_fields", "snapshot_refs", "snapshot_sessions"):
+            conn.executemany(f"DELETE FROM {table} WHERE session_id = ?", params)
+        _delete_orphan_images(conn, digests)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+@st.cache_resource
+def _snapshot_store():
+    """Połączenie z lokalną bazą migawek (SQLite w trybie WAL), wspólne dla wszystkich sesji."""
+    conn = sqlite3.connect(SNAPSHOT_DB, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_fields (
+            session_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            PRIMARY KEY (session_id, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_images (
+            digest TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Które obrazy są używane przez którą sesję (pola z ilustracjami są skompresowane)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_refs (
+            session_id TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (session_id, digest)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_refs_digest ON snapshot_refs (digest)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_sessions (
+            session_id TEXT PRIMARY KEY,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+    # Sprzątanie migawek porzuconych dłużej niż SNAPSHOT_TTL_DAYS (raz na proces, przy pierwszym użyciu bazy)
+    expired = conn.execute(
+        "SELECT session_id FROM snapshot_sessions WHERE updated_at < ?",
+        (time.time() - SNAPSHOT_TTL_DAYS * 86400,)
+    ).fetchall()
+    _purge_snapshots(conn, [sid for (sid,) in expired])
+    return {"lock": threading.Lock(), "conn": conn}
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _pack(value):
+    """Zwarty format binarny pola: JSON bez spacji skompresowany zlib."""
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+def _checkpoint_session():
+    """
+    Zapisuje migawkę sesji przyrostowo: tylko pola zmienione od ostatniego zapisu
+    i tylko nowe obrazy, wszystko w jednej transakcji.
+    """
+    sid = st.session_state.get("snapshot_id")
+    if not sid:
+        return
+    saved = st.session_state.setdefault("_snapshot_digests", {})
+    known_images = st.session_state.setdefault("_snapshot_images", set())
+
+    fields, images, changed, session_refs = [], [], {}, set()
+    for key in SNAPSHOT_KEYS + SNAPSHOT_IMAGE_KEYS:
+        value = st.session_state.get(key)
+        if key in SNAPSHOT_IMAGE_KEYS:
+            refs = {}
+            for scene, data in (value or {}).items():
+                if isinstance(data, (bytes, bytearray)):
+                    digest = _digest(data)
+                    refs[str(scene)] = digest
+                    if digest not in known_images:
+                        images.append((digest, bytes(data)))
+            session_refs.update(refs.values())
+            value = refs
+        blob = _pack(value)
+        blob_digest = _digest(blob)
+        if saved.get(key) != blob_digest:
+            fields.append((sid, key, blob))
+            changed[key] = blob_digest
+
+    if not fields and not images:
+        return
+
+    store = _snapshot_store()
+    released = set()
+    try:
+        with store["lock"]:
+            conn = store["conn"]
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT OR IGNORE INTO snapshot_images (digest, data) VALUES (?, ?)", images)
+                conn.executemany("INSERT OR REPLACE INTO snapshot_fields (session_id, key, value) VALUES (?, ?, ?)", fields)
+                if any(key in changed for key in SNAPSHOT_IMAGE_KEYS):
+                    # Podmienione ilustracje zwalniają stare obrazy
+                    old_refs = {d for (d,) in conn.execute("SELECT digest FROM snapshot_refs WHERE session_id = ?", (sid,))}
+                    released = old_refs - session_refs
+                    conn.executemany("DELETE FROM snapshot_refs WHERE session_id = ? AND digest = ?", [(sid, d) for d in released])
+                    conn.executemany("INSERT OR IGNORE INTO snapshot_refs (session_id, digest) VALUES (?, ?)", [(sid, d) for d in session_refs - old_refs])
+                    _delete_orphan_images(conn, released)
+                conn.execute("INSERT OR REPLACE INTO snapshot_sessions (session_id, updated_at) VALUES (?, ?)", (sid, time.time()))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    except Exception as e:
+        st.warning(f"⚠️ Nie udało się zapisać migawki sesji: {e}")
+        return
+
+    saved.update(changed)
+    known_images.update(digest for digest, _ in images)
+    known_images.difference_update(released)
+    st.query_params["sid"] = sid
+
+def _restore_session():
+    """Przy pierwszym przebiegu sesji odtwarza migawkę wskazaną w adresie (?sid=...)."""
+    if "snapshot_id" in st.session_state:
+        return
+    sid = st.query_params.get("sid")
+    st.session_state.snapshot_id = sid or uuid.uuid4().hex
+    st.session_state._snapshot_digests = {}
+    st.session_state._snapshot_images = set()
+    if not sid:
+        return
+
+    store = _snapshot_store()
+    with store["lock"]:
+        conn = store["conn"]
+        rows = conn.execute("SELECT key, value FROM snapshot_fields WHERE session_id = ?", (sid,)).fetchall()
+        values = {key: _unpack(blob) for key, blob in rows}
+        wanted = {d for key in SNAPSHOT_IMAGE_KEYS for d in (values.get(key) or {}).values()}
+        images = {}
+        if wanted:
+            marks = ",".join("?" * len(wanted))
+            images = dict(conn.execute(f"SELECT digest, data FROM snapshot_images WHERE digest IN ({marks})", tuple(wanted)))
+
+    if not rows:
+        st.warning("⚠️ Nie znaleziono zapisanej sesji – zaczynamy od nowa.")
+        return
+
+    for key, blob in rows:
+        value = values[key]
+        if key in SNAPSHOT_IMAGE_KEYS:
+            value = {scene: images[d] for scene, d in value.items() if d in images}
+        st.session_state[key] = value
+        st.session_state._snapshot_digests[key] = _digest(blob)
+    st.session_state._snapshot_images.update(images)
+
+def _forget_snapshot():
+    """Usuwa migawkę bieżącej sesji i odłącza od niej sesję (wylogowanie / nowe opowiadanie)."""
+    sid = st.session_state.get("snapshot_id")
+    if sid:
+        store = _snapshot_store()
+        try:
+            with store["lock"]:
+                _purge_snapshots(store["conn"], [sid])
+        except sqlite3.Error as e:
+            st.warning(f"⚠️ Nie udało się usunąć migawki sesji: {e}")
+    st.query_params.clear()
+    for key in ("snapshot_id", "_snapshot_digests", "_snapshot_images"):
+        st.session_state.pop(key, None)
+
+_restore_session()
+
 # --- Funkcje pomocnicze ---
 
 def get_preferences_prompt():
@@ -131,160 +452,49 @@ def clean_title_and_extract_number(text):
     scene_num = int(match.group(0)) if match else None
     return cleaned_text, scene_num
 
-def create_pdf(story_text, images_data=None):
-    
-    def _get_image_bytes(images_dict, scene_no):
-        """Zwraca bytes obrazka dla danej sceny (obsługuje klucze str/int i różne formaty wartości)."""
-        if not images_dict:
-            return None
-
-        cand_keys = [str(scene_no), scene_no]  # np. "1" i 1
-        val = None
-        for ck in cand_keys:
-            if ck in images_dict:
-                val = images_dict[ck]
-                break
-
-        if val is None:
-            return None
-
-        # 1️⃣ dict z 'buffer'
-        if isinstance(val, dict) and 'buffer' in val:
-            v = val['buffer']
-            if isinstance(v, bytes):
-                return v
-            if hasattr(v, "read"):
-                v.seek(0)
-                return v.read()
-            return None
-
-        # 2️⃣ surowe bajty
-        if isinstance(val, (bytes, bytearray)):
-            return bytes(val)
-
-        # 3️⃣ BytesIO
-        if hasattr(val, "read"):
-            try:
-                val.seek(0)
-            except Exception:
-                pass
-            return val.read()
-
-        # 4️⃣ URL
-        if isinstance(val, str) and val.startswith(("http://", "https://")):
-            try:
-                return requests.get(val, timeout=20).content
-            except Exception:
-                return None
-
-        return None
+# Liczba procesów do składu PDF (>1 włącza skład równoległy – opłaca się przy długich książkach)
+PDF_WORKERS = int(os.environ.get("FABRYKA_PDF_WORKERS", "1"))
 
+def create_pdf(story_text, images_data=None):
     # Jeśli nie przekazano ilustracji, pobierz je z session_state
     if images_data is None and "scene_images" in st.session_state:
         images_data = st.session_state.scene_images
 
-    buffer = io.BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-
-        # --- Czcionki z polskimi znakami ---
-    pdfmetrics.registerFont(TTFont("LiberationSerif", "LiberationSerif-Regular.ttf"))
-    pdfmetrics.registerFont(TTFont("LiberationSerif-Bold", "LiberationSerif-Bold.ttf"))
-
-    margin = 60
-    text_width = width - 2 * margin
-    y = height - margin
-
-    # --- STRONA TYTUŁOWA ---
-    pdf.setFont("LiberationSerif-Bold", 22)
-    pdf.drawCentredString(width / 2, y, "✨ Opowiadanie stworzone przez Fabrykę Opowiadań AI ✨")
-    y -= 30
-    pdf.setFont("LiberationSerif", 14)
-    y -= 20
-
-    pdf.setLineWidth(0.5)
-    pdf.line(margin, y, width - margin, y)
-    y -= 50
-
-    pdf.setFont("LiberationSerif", 12)
-
-    # --- Numeracja stron ---
-    page_num = 1
-
-    def new_page():
-        """Nowa strona z numerem."""
-        nonlocal y, page_num
-        pdf.showPage()
-        pdf.setFont("LiberationSerif", 12)
-        page_num += 1
-        y = height - margin
-        pdf.setFont("LiberationSerif", 10)
-        pdf.drawCentredString(width / 2, 30, f"Strona {page_num}")
-        pdf.setFont("LiberationSerif", 12)
-
-    # --- Główna treść ---
-    lines = story_text.split("\n")
-    scene_num = 1
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            y -= 10
-            continue
-
-        # --- Tytuł rozdziału ---
-        if line.lower().startswith("rozdział"):
-        # oczyść markdown/cudzysłowy:
-            clean_title = re.sub(r'[*"_`#]+', '', line).strip()
-            pdf.setFont("LiberationSerif-Bold", 16)
-            pdf.drawString(margin, y, clean_title)
-            y -= 18
-            pdf.setLineWidth(0.3)
-            pdf.line(margin, y, margin + 180, y)
-            y -= 25
-            pdf.setFont("LiberationSerif", 12)
-
-            # --- Ilustracja dla rozdziału ---
-            try:
-                img_bytes = _get_image_bytes(images_data, scene_num)
-                if img_bytes:
-                    bio = io.BytesIO(img_bytes)
-                    img_reader = ImageReader(bio)
-                    iw, ih = img_reader.getSize()
-                    max_w = text_width * 0.7
-                    scale = min(1.0, max_w / float(iw))
-                    img_w = iw * scale
-                    img_h = ih * scale
-
-                    if y - img_h < margin:
-                        new_page()
-
-                    x_center = (width - img_w) / 2
-                    pdf.drawImage(img_reader, x_center, y - img_h - 10,
-                                  width=img_w, height=img_h)
-                    y -= img_h + 30
-            except Exception as e:
-                st.warning(f"⚠️ Nie udało się dodać ilustracji dla rozdziału {scene_num}: {e}")
-
-            scene_num += 1
-
-        else:
-            # --- Tekst opowiadania ---
-            while len(line) > 0:
-                text_line = line[:95]
-                line = line[95:]
-                pdf.drawString(margin, y, text_line)
-                y -= 15
-                if y < 80:
-                    new_page()
-
-    # --- Stopka na końcu ---
-    pdf.setFont("LiberationSerif", 10)
-    pdf.drawCentredString(width / 2, 40, f"Fabryka Opowiadań AI © {page_num} str.")
-
-    pdf.save()
-    buffer.seek(0)
-    return buffer
+    def _warn(scene_num, e):
+        st.warning(f"⚠️ Nie udało się dodać ilustracji dla rozdziału {scene_num}: {e}")
+
+    if PDF_WORKERS > 1:
+        return render_story_pdf_parallel(story_text, images_data, workers=PDF_WORKERS, on_image_error=_warn)
+    return render_story_pdf(story_text, images_data, on_image_error=_warn)
+
+# --- Eksport (PDF / EPUB / HTML) z pamięcią podręczną ---
+# Krok końcowy jest przebiegany przy każdej interakcji, a pliki zależą tylko od
+# tekstu i ilustracji – kluczem jest tekst i skróty obrazów (same obrazy, jako
+# argumenty z "_", nie są haszowane przez Streamlit).
+def _images_key(images_data):
+    return tuple(sorted(
+        (str(scene), _digest(data) if isinstance(data, (bytes, bytearray)) else repr(data))
+        for scene, data in (images_data or {}).items()
+    ))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _export_pdf(story_text, images_key, _images_data):
+    return create_pdf(story_text, _images_data).getvalue()
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _ebook_images(story_text, images_key, _images_data):
+    """Ilustracje zmniejszone raz, wspólne dla EPUB i HTML."""
+    return prepare_images(story_text, _images_data)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _export_epub(story_text, images_key, _images_data):
+    images = _ebook_images(story_text, images_key, _images_data)
+    return create_epub(story_text, images, resized=True).getvalue()
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _export_html(story_text, images_key, _images_data):
+    images = _ebook_images(story_text, images_key, _images_data)
+    return create_html(story_text, images, resized=True)
     
 
 def handle_image_generation(scenes):
@@ -336,8 +546,11 @@ def handle_image_generation(scenes):
         Styl graficzny: {style_key.lower()} – {base_prompt}.
         """
 
+        token = _start_job("image")
         try:
+            token.raise_if_cancelled()
             # 🧠 Stare API (openai==0.28.0)
+            started = time.perf_counter()
             response = openai.Image.create(
                 model="dall-e-3",
                 prompt=prompt,
@@ -345,9 +558,11 @@ def handle_image_generation(scenes):
                 size="1024x1024"
             )
             # 💰 Zapisz koszt ilustracji (DALL·E)
-            _add_image_cost(1)
+            _add_image_cost(1, latency_ms=(time.perf_counter() - started) * 1000)
             st.info(f"🖼️ Dodano koszt 1 ilustracji. Łącznie: {st.session_state.cost_pln:.2f} zł")
 
+            # Obraz już opłacony, ale nie pobieramy go, jeśli zadanie straciło aktualność
+            token.raise_if_cancelled()
 
             image_url = response["data"][0]["url"]
 
@@ -356,9 +571,12 @@ def handle_image_generation(scenes):
 
             # 🔸 ZAPISUJEMY POD KLUCZEM STRINGOWYM, ŻEBY PDF TO ZNALAZŁ
             st.session_state.scene_images[str(action_idx)] = img_data
+            _checkpoint_session()
 
             st.success(f"✅ Ilustracja dla Sceny {action_idx} gotowa!")
 
+        except GenerationCancelled:
+            st.info(f"⏹️ Generowanie ilustracji dla Sceny {action_idx} przerwane.")
         except Exception as e:
             st.error(f"❌ Błąd generowania ilustracji dla Sceny {action_idx}: {e}")
 
@@ -386,6 +604,7 @@ else:
     st.sidebar.success("🔑 Klucz API jest aktywny.")
 
     if st.sidebar.button("🚪 Wyloguj"):
+        _forget_snapshot()
         st.session_state.clear()
         init_session_state()
         st.sidebar.info("🔄 Wylogowano.")
@@ -440,6 +659,15 @@ with st.sidebar.form("story_settings_sidebar"):
         key="sb_length"
     )
 
+    # 2b. Ile wariantów planu przygotować (jedno zapytanie, wspólny prompt)
+    st.session_state.plan_variants = st.slider(
+        "Liczba wariantów planu do wyboru:",
+        min_value=1,
+        max_value=4,
+        value=st.session_state.get('plan_variants', 1),
+        key="sb_plan_variants"
+    )
+
     st.markdown("---")
     st.subheader("🎭 Fabuła i Styl")
     
@@ -533,6 +761,7 @@ with st.sidebar.form("story_settings_sidebar"):
 if submitted_settings:
     # Reset historii po zmianie parametrów
     st.session_state.plan = None
+    st.session_state.plan_candidates = None
     st.session_state.story = None
     st.session_state.scene_images = {}
     st.session_state.step = "start" # Zawsze wracamy na start po zmianie ustawień
@@ -571,25 +800,30 @@ if submitted_settings:
         SCENA {scene_count}: ...
         """
         
+        token = _start_job("plan")
         try:
-            response = openai.ChatCompletion.create(
-                model=st.session_state.model,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1500,
-                temperature=0.8
-            )
-            
-            st.session_state.plan = response.choices[0].message["content"]
-            st.session_state.step = "plan"
+            # 💰 Koszt tokenów (plan) zapisuje _stream_chat_choices – także po przerwaniu
+            variants = st.session_state.plan_variants
+            plan_texts, usage = _stream_chat_choices(prompt, 1500, 0.8, token, placeholder=st.empty(), n=variants)
+            plan_texts = [p for p in plan_texts if p.strip()]
+
+            if len(plan_texts) > 1:
+                # Kilka wariantów – użytkownik wybiera jeden w kroku "choose_plan"
+                st.session_state.plan_candidates = plan_texts
+                st.session_state.step = "choose_plan"
+            else:
+                st.session_state.plan = plan_texts[0] if plan_texts else ""
+                st.session_state.step = "plan"
+            _checkpoint_session()
             st.success("Plan opowiadania gotowy!")
 
-            # 💰 Zapisz koszty tokenów (plan)
-            if hasattr(response, "usage"):
-                _add_chat_cost(response.usage)
-                used = response.usage.get("total_tokens", 0)
-                st.info(f"💰 Użyto {used} tokenów (łącznie: {st.session_state.cost_pln:.2f} zł)")
+            used = usage.get("total_tokens", 0)
+            st.info(f"💰 Użyto {used} tokenów (łącznie: {st.session_state.cost_pln:.2f} zł)")
    
         
+        except GenerationCancelled:
+            st.info("⏹️ Generowanie planu przerwane.")
+            st.session_state.step = "start"
         except Exception as e:
             st.error(f"❌ Wystąpił błąd podczas generowania planu: {e}")
             st.session_state.step = "start"
@@ -604,6 +838,26 @@ if st.session_state.step == "start":
     st.info("Wprowadź wszystkie szczegóły w panelu bocznym i naciśnij 'Generuj Plan Opowiadania 🚀', aby kontynuować.")
 
 
+# --- KROK 1b: WYBÓR PLANU (kilka wariantów obok siebie) ---
+if st.session_state.step == "choose_plan" and st.session_state.plan_candidates:
+    st.header("2. Wybierz plan opowiadania")
+    st.caption("Wybierz wariant, który najbardziej Ci się podoba – od razu przejdziesz do ilustracji.")
+    st.divider()
+
+    candidate_cols = st.columns(len(st.session_state.plan_candidates))
+    for idx, (col, candidate) in enumerate(zip(candidate_cols, st.session_state.plan_candidates), start=1):
+        with col:
+            with st.container(border=True):
+                st.subheader(f"Wariant {idx}")
+                st.markdown(candidate.replace("\n", "  \n"))
+                if st.button(f"✅ Wybieram wariant {idx}", key=f"pick_plan_{idx}", use_container_width=True):
+                    st.session_state.plan = candidate
+                    st.session_state.plan_candidates = None
+                    st.session_state.step = "plan"
+                    _checkpoint_session()
+                    st.rerun()
+
+
 # --- KROK 2: PLAN (Wyświetlanie i generowanie ilustracji) ---
 if st.session_state.step == "plan" and st.session_state.plan:
     st.header("2. Akceptacja planu i ilustracje")
@@ -690,6 +944,7 @@ if st.session_state.step == "plan" and st.session_state.plan:
             st.warning("⚠️ Brak ilustracji w scene_images — PDF będzie bez obrazków.")
 
         st.session_state.step = "writing"
+        _checkpoint_session()
         st.session_state['generate_scene_idx'] = None
         st.session_state['regenerate_scene_idx'] = None
         st.rerun()
@@ -727,21 +982,21 @@ if st.session_state.step == "writing":
             ---
             """
             
+            token = _start_job("story")
             try:
-                response = openai.ChatCompletion.create(
-                    model=st.session_state.model, 
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=3500, # Max tokenów dla GPT-4o, aby pozwolić na długie opowieści
-                    temperature=0.7
-                )
-                st.session_state.story = response.choices[0].message["content"]
+                # Max tokenów dla GPT-4o, aby pozwolić na długie opowieści
+                story_text, usage = _stream_chat(prompt, 3500, 0.7, token, placeholder=st.empty())
+                st.session_state.story = story_text
+                _checkpoint_session()
                 st.success("Opowiadanie gotowe!")
-                    # 💰 Zapisz koszty tokenów (pełna historia)
-                if hasattr(response, "usage"):
-                    _add_chat_cost(response.usage)
-                    used = response.usage.get("total_tokens", 0)
-                    st.info(f"💰 Użyto {used} tokenów (łącznie: {st.session_state.cost_pln:.2f} zł)")
+                    # 💰 Koszty tokenów (pełna historia) zapisuje _stream_chat
+                used = usage.get("total_tokens", 0)
+                st.info(f"💰 Użyto {used} tokenów (łącznie: {st.session_state.cost_pln:.2f} zł)")
 
+                st.rerun()
+            except GenerationCancelled:
+                st.info("⏹️ Pisanie historii przerwane.")
+                st.session_state.step = "plan"
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ Błąd podczas pisania historii. Spróbuj ponownie. Błąd: {e}")
@@ -770,6 +1025,7 @@ if st.session_state.step == "writing":
         with colD:
             if st.button("💾 Zakończ i generuj PDF", key="go_to_final"):
                 st.session_state.step = "final"
+                _checkpoint_session()
                 st.rerun()
 
 
@@ -780,7 +1036,7 @@ if st.session_state.step == "final":
     st.success("Twoja historia została pomyślnie stworzona i jest gotowa do pobrania jako PDF.")
     st.markdown("---")
     
-    st.subheader("Pobieranie pliku PDF")
+    st.subheader("Pobieranie pliku PDF / EPUB / HTML")
 
         # 💰 Podsumowanie kosztów całej sesji
     if "cost_pln" in st.session_state:
@@ -797,21 +1053,42 @@ if st.session_state.step == "final":
             
                 
 
+            images_key = _images_key(images_to_use)
+
             # Tworzymy PDF z właściwym zestawem ilustracji
-            pdf_buffer = create_pdf(
-                st.session_state.story,
-                images_to_use
-            )
+            pdf_buffer = _export_pdf(st.session_state.story, images_key, images_to_use)
+
+            # Lżejsze formaty na telefon (te same rozdziały i ilustracje)
+            epub_buffer = _export_epub(st.session_state.story, images_key, images_to_use)
+            html_bytes = _export_html(st.session_state.story, images_key, images_to_use)
             
 
 
-        st.download_button(
-    label="📘 Pobierz gotowy e-book (PDF z ilustracjami)",
-    data=pdf_buffer,
-    file_name="fabryka_opowiadan.pdf",
-    mime="application/pdf",
-    use_container_width=True
-)
+        col_pdf, col_epub, col_html = st.columns(3)
+        with col_pdf:
+            st.download_button(
+                label="📘 Pobierz gotowy e-book (PDF z ilustracjami)",
+                data=pdf_buffer,
+                file_name="fabryka_opowiadan.pdf",
+                mime="application/pdf",
+                use_container_width=True
+            )
+        with col_epub:
+            st.download_button(
+                label="📱 Pobierz EPUB (czytniki i telefony)",
+                data=epub_buffer,
+                file_name="fabryka_opowiadan.epub",
+                mime="application/epub+zip",
+                use_container_width=True
+            )
+        with col_html:
+            st.download_button(
+                label="🌐 Pobierz HTML (jeden plik)",
+                data=html_bytes,
+                file_name="fabryka_opowiadan.html",
+                mime="text/html",
+                use_container_width=True
+            )
 
 
     st.markdown("---")
@@ -824,6 +1101,7 @@ if st.session_state.step == "final":
 
     with col_final_2:
         if st.button("🔄 Stwórz nowe opowiadanie", key="new_story_final"):
+            _forget_snapshot()
             # Zachowaj tylko klucz API i presety stylów, resztę usuń
             keep_keys = ["api_key", "STYLE_PROMPTS"] 
             keys_to_delete = [key for key in st.session_state.keys() if key not in keep_keys]
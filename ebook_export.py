@@ -0,0 +1,240 @@
+"""
+Lekki eksport opowiadań do EPUB 3 i jednego pliku HTML – szybsza i mniejsza
+alternatywa dla PDF, wygodna do czytania na telefonie.
+
+Pomiar względem PDF dla gotowego tekstu i ilustracji:
+
+    python ebook_export.py opowiadanie.txt scena1.png scena2.png ...
+"""
+import io
+import re
+import sys
+import time
+import uuid
+import base64
+import hashlib
+import zipfile
+from html import escape
+from datetime import datetime, timezone
+from PIL import Image
+from pdf_export import get_image_bytes, render_story_pdf
+
+DEFAULT_TITLE = "Opowiadanie – Fabryka Opowiadań AI"
+
+# Ilustracje są zmniejszane do tej szerokości/wysokości i zapisywane jako JPEG
+IMAGE_MAX_SIZE = 800
+IMAGE_QUALITY = 80
+
+CSS = """
+body { font-family: serif; line-height: 1.5; margin: 0 5%; }
+h1 { text-align: center; }
+h2 { border-bottom: 1px solid #999; padding-bottom: .2em; }
+figure { margin: 1em 0; text-align: center; }
+img { max-width: 100%; height: auto; }
+p { text-indent: 1.2em; margin: 0 0 .6em 0; }
+""".strip()
+
+
+def split_chapters(story_text):
+    """
+    Dzieli tekst na rozdziały tak samo jak skład PDF: nowy rozdział zaczyna się od
+    linii „ROZDZIAŁ …”. Zwraca listę (tytuł, akapity, nr_sceny); tekst przed pierwszym
+    nagłówkiem trafia do rozdziału bez tytułu i bez numeru sceny.
+    """
+    chapters = []
+    title, paragraphs, scene_num = None, [], None
+    next_scene = 1
+
+    for line in story_text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if line.lower().startswith("rozdział"):
+            if title is not None or paragraphs:
+                chapters.append((title, paragraphs, scene_num))
+            title = re.sub(r'[*"_`#]+', '', line).strip()
+            paragraphs = []
+            scene_num = next_scene
+            next_scene += 1
+        else:
+            paragraphs.append(line)
+
+    if title is not None or paragraphs:
+        chapters.append((title, paragraphs, scene_num))
+    return chapters
+
+def _resize_image(img_bytes):
+    """Zmniejsza ilustrację do IMAGE_MAX_SIZE i zwraca bajty JPEG."""
+    with Image.open(io.BytesIO(img_bytes)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE))
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=IMAGE_QUALITY, optimize=True)
+    return out.getvalue()
+
+def prepare_images(story_text, images_data):
+    """
+    Zmniejszone ilustracje rozdziałów: {nr_sceny: bajty JPEG}. Każdy obraz jest
+    dekodowany raz – wynik można przekazać do create_epub i create_html
+    z resized=True, gdy potrzebne są oba formaty.
+    """
+    prepared, by_digest = {}, {}
+    for _, _, scene_num in split_chapters(story_text):
+        img_bytes = get_image_bytes(images_data, scene_num) if scene_num else None
+        if img_bytes:
+            digest = hashlib.blake2b(img_bytes, digest_size=8).digest()
+            if digest not in by_digest:
+                by_digest[digest] = _resize_image(img_bytes)
+            prepared[scene_num] = by_digest[digest]
+    return prepared
+
+def _chapter_body(title, paragraphs, img_src):
+    parts = []
+    if title:
+        parts.append(f"<h2>{escape(title)}</h2>")
+    if img_src:
+        parts.append(f'<figure><img src="{img_src}" alt="{escape(title or "")}"/></figure>')
+    parts.extend(f"<p>{escape(p)}</p>" for p in paragraphs)
+    return "\n".join(parts)
+
+def _xhtml(title, body):
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="pl" lang="pl">
+<head><meta charset="utf-8"/><title>{escape(title)}</title><link rel="stylesheet" type="text/css" href="style.css"/></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def create_epub(story_text, images_data=None, output=None, title=DEFAULT_TITLE, resized=False):
+    """
+    Tworzy EPUB 3 z rozdziałami i ilustracjami. Kontener zip jest zapisywany
+    wpis po wpisie do output (ścieżka lub obiekt plikowy; domyślnie io.BytesIO),
+    a każda ilustracja jest zmniejszana i zapisywana tylko raz, nawet jeśli
+    powtarza się w kilku rozdziałach. resized=True: images_data pochodzi
+    z prepare_images. Zwraca output.
+    """
+    if output is None:
+        output = io.BytesIO()
+    if not resized:
+        images_data = prepare_images(story_text, images_data)
+
+    chapters = split_chapters(story_text)
+    manifest, spine, nav = [], [], []
+    stored_images = {}  # skrót oryginału -> nazwa pliku w EPUB
+
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
+        # mimetype musi być pierwszy i nieskompresowany
+        zf.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+""")
+        zf.writestr("OEBPS/style.css", CSS)
+        manifest.append('<item id="css" href="style.css" media-type="text/css"/>')
+
+        for idx, (chapter_title, paragraphs, scene_num) in enumerate(chapters, start=1):
+            img_src = None
+            img_bytes = images_data.get(scene_num)
+            if img_bytes:
+                digest = hashlib.blake2b(img_bytes, digest_size=8).hexdigest()
+                if digest not in stored_images:
+                    name = f"images/{digest}.jpg"
+                    zf.writestr(f"OEBPS/{name}", img_bytes, compress_type=zipfile.ZIP_STORED)
+                    manifest.append(f'<item id="img-{digest}" href="{name}" media-type="image/jpeg"/>')
+                    stored_images[digest] = name
+                img_src = stored_images[digest]
+
+            href = f"chapter-{idx}.xhtml"
+            label = chapter_title or title
+            zf.writestr(f"OEBPS/{href}", _xhtml(label, _chapter_body(chapter_title, paragraphs, img_src)))
+            manifest.append(f'<item id="ch{idx}" href="{href}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="ch{idx}"/>')
+            nav.append(f'<li><a href="{href}">{escape(label)}</a></li>')
+
+        nav_body = f'<h1>{escape(title)}</h1>\n<nav epub:type="toc" id="toc"><ol>\n' + "\n".join(nav) + "\n</ol></nav>"
+        zf.writestr("OEBPS/nav.xhtml", _xhtml(title, nav_body))
+        manifest.append('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
+
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        zf.writestr("OEBPS/content.opf", f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid" xml:lang="pl">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="bookid">urn:uuid:{uuid.uuid4()}</dc:identifier>
+    <dc:title>{escape(title)}</dc:title>
+    <dc:language>pl</dc:language>
+    <dc:creator>Fabryka Opowiadań AI</dc:creator>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    {chr(10).join(manifest)}
+  </manifest>
+  <spine>
+    {chr(10).join(spine)}
+  </spine>
+</package>
+""")
+
+    if hasattr(output, "seek"):
+        output.seek(0)
+    return output
+
+def create_html(story_text, images_data=None, title=DEFAULT_TITLE, resized=False):
+    """
+    Tworzy jeden samodzielny plik HTML (ilustracje osadzone jako data URI) i zwraca
+    go jako bytes. resized=True: images_data pochodzi z prepare_images.
+    """
+    if not resized:
+        images_data = prepare_images(story_text, images_data)
+    sections = []
+    for chapter_title, paragraphs, scene_num in split_chapters(story_text):
+        img_src = None
+        img_bytes = images_data.get(scene_num)
+        if img_bytes:
+            img_src = "data:image/jpeg;base64," + base64.b64encode(img_bytes).decode("ascii")
+        sections.append(f"<section>\n{_chapter_body(chapter_title, paragraphs, img_src)}\n</section>")
+
+    page = f"""<!DOCTYPE html>
+<html lang="pl">
+<head>
+<meta charset="utf-8"/>
+<meta name="viewport" content="width=device-width, initial-scale=1"/>
+<title>{escape(title)}</title>
+<style>
+{CSS}
+</style>
+</head>
+<body>
+<h1>{escape(title)}</h1>
+{chr(10).join(sections)}
+</body>
+</html>
+"""
+    return page.encode("utf-8")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Użycie: python ebook_export.py opowiadanie.txt [scena1.png scena2.png ...]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        text = f.read()
+    images = {str(i): path for i, path in enumerate(sys.argv[2:], start=1)}
+    base = sys.argv[1].rsplit(".", 1)[0]
+
+    for label, render, ext in (
+        ("PDF", lambda: render_story_pdf(text, images).getvalue(), "pdf"),
+        ("EPUB", lambda: create_epub(text, images).getvalue(), "epub"),
+        ("HTML", lambda: create_html(text, images), "html"),
+    ):
+        start = time.perf_counter()
+        data = render()
+        elapsed = time.perf_counter() - start
+        with open(f"{base}.{ext}", "wb") as f:
+            f.write(data)
+        print(f"{label:>4}: {elapsed * 1000:8.1f} ms, {len(data) / 1024:8.1f} KB -> {base}.{ext}")
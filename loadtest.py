@@ -0,0 +1,312 @@
+"""
+Test obciążeniowy: wiele równoległych, symulowanych sesji przechodzi przez
+prawdziwy skrypt app.py (Streamlit AppTest, bez przeglądarki) z atrapą OpenAI.
+
+Każda sesja przechodzi ścieżkę start -> plan -> ilustracje -> pisanie -> final
+z losowym czasem namysłu między krokami. Dla kolejnych poziomów współbieżności
+raport podaje percentyle czasu przebiegu skryptu (rerun), przyrost RSS na sesję
+oraz punkt nasycenia (pierwszy poziom, na którym p95 przekracza --slo-ms).
+
+    python loadtest.py --levels 1,2,4,8,16 --think 0.5,2 --api-latency 0.5
+
+Z --plan-variants N (2–4) sesje zamawiają kilka wariantów planu w jednym
+zapytaniu i przechodzą dodatkowo krok wyboru planu (choose_plan).
+
+AppTest jest pomyślany do pojedynczych testów, więc dla równoległych sesji
+setup() podmienia w Streamlit globalny stan, który AppTest przełącza przy
+każdym przebiegu: każda sesja dostaje własne session_id (zamiast wspólnego
+"test session id"), a Runtime i opcja "global.appTest" są ustawione na stałe.
+Podmiany dotyczą całego procesu, dlatego robi je dopiero main(), a nie import
+modułu.
+"""
+import io
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import contextlib
+import tempfile
+import threading
+import resource
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import requests
+import openai
+from PIL import Image, ImageFilter
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import app_test as _app_test
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+
+
+# --- Izolacja sesji w AppTest ---
+_local = threading.local()
+_runtime = None
+
+
+class _SessionScriptRunner(_app_test.LocalScriptRunner):
+    """LocalScriptRunner z session_id bieżącej symulowanej sesji (wątku)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._session_id = getattr(_local, "session_id", "loadtest")
+
+def setup():
+    """Przygotowuje proces do równoległych sesji AppTest (wywoływane raz, z main())."""
+    global _runtime
+    if _runtime is not None:
+        return
+
+    # Jak przy "streamlit run": katalog skryptu w sys.path (pdf_export, ebook_export)
+    # i jako katalog roboczy (czcionki, style_presets.json)
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+
+    _runtime = MagicMock(spec=Runtime)
+    _runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    _runtime.cache_storage_manager = MemoryCacheStorageManager()
+
+    # AppTest ustawia i zeruje globalny Runtime przy każdym przebiegu – przy wielu
+    # wątkach to wyścig, więc wszystkie sesje dostają ten sam, stały Runtime
+    Runtime.instance = classmethod(lambda cls: _runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    _app_test.LocalScriptRunner = _SessionScriptRunner
+
+    # AppTest włącza "global.appTest" tymczasową podmianą config.get_option, która
+    # przy wielu wątkach się przeplata – ustawiamy opcję raz, na stałe
+    config.set_option("global.appTest", True)
+    _app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+
+
+# --- Atrapa OpenAI ---
+def _make_png():
+    """Ilustracja 1024x1024 o rozmiarze zbliżonym do prawdziwej z DALL·E."""
+    noise = Image.frombytes("RGB", (1024, 1024), os.urandom(1024 * 1024 * 3)).filter(ImageFilter.GaussianBlur(2))
+    out = io.BytesIO()
+    noise.save(out, "PNG")
+    return out.getvalue()
+
+def install_mock_backend(api_latency, image_latency):
+    """Podmienia ChatCompletion/Image oraz pobieranie obrazka na atrapy z opóźnieniem."""
+    png = _make_png()
+    words = "Smok szedł przez las i rozmyślał o przyjaźni, odwadze oraz o tym, co przyniesie jutro.".split()
+
+    def chat_create(**kwargs):
+        prompt = kwargs["messages"][0]["content"]
+        n = kwargs.get("n", 1)
+        if "SCENA" in prompt and "Plan do wykorzystania" not in prompt:
+            # Zapytanie o plan – tyle scen, ile wymaga prompt
+            match = re.search(r"dokładnie (\d+) punktów", prompt)
+            count = int(match.group(1)) if match else 5
+            text = "\n".join(f"SCENA {i}: {' '.join(random.sample(words, 8))}." for i in range(1, count + 1))
+        else:
+            text = "\n\n".join(
+                f"ROZDZIAŁ {i}: Przygoda {i}\n\n" + "\n\n".join(" ".join(random.choices(words, k=80)) for _ in range(4))
+                for i in range(1, 6)
+            )
+        pieces = text.split(" ")
+        delay = api_latency / max(1, len(pieces))
+
+        def stream():
+            for index in range(n):
+                for piece in pieces:
+                    time.sleep(delay / n)
+                    yield {"choices": [{"index": index, "delta": {"content": piece + " "}}]}
+            prompt_tokens = len(prompt) // 4
+            completion_tokens = len(pieces) * n
+            yield {"choices": [], "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }}
+        return stream()
+
+    def image_create(**kwargs):
+        time.sleep(image_latency)
+        return {"data": [{"url": "https://mock.invalid/image.png"}]}
+
+    class _Download:
+        def __init__(self):
+            self.content = bytes(bytearray(png))  # osobna kopia na sesję, jak prawdziwe pobranie
+
+    openai.ChatCompletion.create = staticmethod(chat_create)
+    openai.Image.create = staticmethod(image_create)
+    requests.get = lambda *args, **kwargs: _Download()
+
+
+# --- Pomiary ---
+def rss_mb():
+    """Bieżący RSS procesu w MB (Linux: /proc; inaczej szczyt z getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+class _RssSampler(threading.Thread):
+    """Próbkuje RSS w tle i zapamiętuje maksimum."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# --- Symulowana sesja ---
+def _button(at, label_prefix):
+    for b in at.button:
+        if b.label.startswith(label_prefix):
+            return b
+    raise RuntimeError(f"brak przycisku '{label_prefix}' (krok: {at.session_state['step']})")
+
+def simulate_session(idx, args, sessions):
+    """Przechodzi pełną ścieżkę jednej sesji; zwraca listę (krok, czas_s) i ewentualny błąd."""
+    _local.session_id = f"loadtest-{idx}"
+    rng = random.Random(args.seed + idx)
+    timings = []
+
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    sessions.append(at)
+
+    def step(name, action):
+        time.sleep(rng.uniform(*args.think))
+        action()
+        _runtime.media_file_mgr.clear_session_refs(_local.session_id)
+        start = time.perf_counter()
+        at.run()
+        timings.append((name, time.perf_counter() - start))
+        _runtime.media_file_mgr.remove_orphaned_files()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        for err in at.error:
+            raise RuntimeError(err.value)
+
+    try:
+        step("start", lambda: None)
+        step("api_key", lambda: at.sidebar.text_input[0].input("sk-loadtest"))
+        if args.plan_variants > 1:
+            def submit_with_variants():
+                at.slider(key="sb_plan_variants").set_value(args.plan_variants)
+                _button(at, "Start!").click()
+
+            step("plan", submit_with_variants)
+            step("choose_plan", lambda: _button(at, f"✅ Wybieram wariant {rng.randint(1, args.plan_variants)}").click())
+        else:
+            step("plan", lambda: _button(at, "Start!").click())
+        for scene in range(1, args.images + 1):
+            step("image", lambda scene=scene: _button(at, f"🎨 Generuj ilustrację ({scene})").click())
+        step("writing", lambda: _button(at, "✍️ Akceptuję").click())
+        step("final", lambda: _button(at, "💾 Zakończ").click())
+    except Exception as e:
+        return timings, f"sesja {idx}: {e}"
+    return timings, None
+
+def run_level(concurrency, args):
+    sessions = []
+    baseline = rss_mb()
+    sampler = _RssSampler()
+    sampler.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: simulate_session(i, args, sessions), range(concurrency)))
+    wall = time.perf_counter() - start
+    sampler.stop()
+
+    timings = [t for session_timings, _ in results for t in session_timings]
+    errors = [err for _, err in results if err]
+    latencies = [t for _, t in timings]
+    by_step = {}
+    for name, t in timings:
+        by_step.setdefault(name, []).append(t)
+
+    sessions.clear()
+    return {
+        "concurrency": concurrency,
+        "runs": len(latencies),
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "max": max(latencies, default=0) * 1000,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "rss_per_session": max(0.0, sampler.peak - baseline) / concurrency,
+        "errors": errors,
+        "by_step": by_step,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test obciążeniowy Fabryki Opowiadań (AppTest + atrapa OpenAI).")
+    parser.add_argument("--levels", default="1,2,4,8", help="poziomy współbieżności, np. 1,2,4,8,16")
+    parser.add_argument("--think", default="0.2,1.0", help="czas namysłu między krokami (min,max) w sekundach")
+    parser.add_argument("--api-latency", type=float, default=0.5, help="czas odpowiedzi atrapy ChatCompletion [s]")
+    parser.add_argument("--image-latency", type=float, default=0.5, help="czas odpowiedzi atrapy DALL·E [s]")
+    parser.add_argument("--images", type=int, default=3, help="liczba ilustracji generowanych w sesji")
+    parser.add_argument("--plan-variants", type=int, default=1, choices=range(1, 5),
+                        help="liczba wariantów planu w jednym zapytaniu (>1 dodaje krok wyboru planu)")
+    parser.add_argument("--slo-ms", type=float, default=2000, help="próg p95 czasu przebiegu wyznaczający nasycenie")
+    parser.add_argument("--timeout", type=float, default=300, help="limit czasu pojedynczego przebiegu [s]")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.think = tuple(float(x) for x in args.think.split(","))
+    levels = [int(x) for x in args.levels.split(",")]
+
+    # Migawki sesji i rejestr zużycia do plików tymczasowych, żeby nie mieszać z danymi aplikacji
+    tmp_dir = tempfile.mkdtemp(prefix="fabryka_loadtest_")
+    os.environ["FABRYKA_SNAPSHOT_DB"] = os.path.join(tmp_dir, "sessions.db")
+    os.environ["FABRYKA_USAGE_DB"] = os.path.join(tmp_dir, "usage.db")
+    setup()
+    install_mock_backend(args.api_latency, args.image_latency)
+
+    print(f"{'sesje':>6} {'przebiegi':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'przeb./s':>8} {'RSS/sesję MB':>13} {'błędy':>6}")
+    saturation = None
+    last = None
+    for level in levels:
+        r = run_level(level, args)
+        last = r
+        print(f"{r['concurrency']:>6} {r['runs']:>9} {r['p50']:>8.0f} {r['p95']:>8.0f} {r['p99']:>8.0f} {r['max']:>8.0f} "
+              f"{r['throughput']:>8.2f} {r['rss_per_session']:>13.1f} {len(r['errors']):>6}")
+        for err in r["errors"][:3]:
+            print(f"       ⚠️ {err}")
+        if saturation is None and (r["p95"] > args.slo_ms or r["errors"]):
+            saturation = level
+
+    if last:
+        print(f"\nCzasy kroków przy {last['concurrency']} sesjach (p50 / p95 ms):")
+        for name, values in last["by_step"].items():
+            print(f"  {name:<11} {percentile(values, 50) * 1000:8.0f} / {percentile(values, 95) * 1000:8.0f}")
+
+    if saturation is None:
+        print(f"\nNasycenie: nie osiągnięto do {levels[-1]} sesji (p95 <= {args.slo_ms:.0f} ms).")
+    else:
+        print(f"\nNasycenie: {saturation} równoległych sesji (p95 > {args.slo_ms:.0f} ms lub błędy).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,682 @@
+"""
+Eksport opowiadań do PDF (ReportLab).
+
+Moduł nie zależy od Streamlit, więc można go używać także poza aplikacją,
+np. do składania antologii z wielu opowiadań w jeden plik:
+
+    python pdf_export.py antologia.json antologia.pdf
+
+gdzie antologia.json to lista wpisów:
+    [{"title": "...", "story_file": "opowiadanie.txt", "images": {"1": "scena1.png"}}, ...]
+(zamiast "story_file" można podać tekst bezpośrednio w polu "story").
+"""
+import io
+import os
+import gc
+import hashlib
+import re
+import sys
+import json
+import requests
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject, TextStringObject
+)
+import reportlab
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.utils import ImageReader
+
+# --- Czcionki z polskimi znakami (rejestrowane raz, przy imporcie) ---
+FONT_DIR = os.path.dirname(os.path.abspath(__file__))
+pdfmetrics.registerFont(TTFont("LiberationSerif", os.path.join(FONT_DIR, "LiberationSerif-Regular.ttf")))
+pdfmetrics.registerFont(TTFont("LiberationSerif-Bold", os.path.join(FONT_DIR, "LiberationSerif-Bold.ttf")))
+
+PAGE_WIDTH, PAGE_HEIGHT = letter
+MARGIN = 60
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+
+# Spis treści antologii – liczba pozycji na stronę
+TOC_ENTRIES_PER_PAGE = 30
+
+
+def get_image_bytes(images_dict, scene_no):
+    """Zwraca bytes obrazka dla danej sceny (obsługuje klucze str/int i różne formaty wartości)."""
+    if not images_dict:
+        return None
+
+    cand_keys = [str(scene_no), scene_no]  # np. "1" i 1
+    val = None
+    for ck in cand_keys:
+        if ck in images_dict:
+            val = images_dict[ck]
+            break
+
+    if val is None:
+        return None
+
+    # 1️⃣ dict z 'buffer'
+    if isinstance(val, dict) and 'buffer' in val:
+        v = val['buffer']
+        if isinstance(v, bytes):
+            return v
+        if hasattr(v, "read"):
+            v.seek(0)
+            return v.read()
+        return None
+
+    # 2️⃣ surowe bajty
+    if isinstance(val, (bytes, bytearray)):
+        return bytes(val)
+
+    # 3️⃣ BytesIO
+    if hasattr(val, "read"):
+        try:
+            val.seek(0)
+        except Exception:
+            pass
+        return val.read()
+
+    # 4️⃣ URL
+    if isinstance(val, str) and val.startswith(("http://", "https://")):
+        try:
+            return requests.get(val, timeout=20).content
+        except Exception:
+            return None
+
+    # 5️⃣ ścieżka do pliku (czytana dopiero przy rysowaniu strony)
+    if isinstance(val, (str, os.PathLike)) and os.path.isfile(val):
+        with open(val, "rb") as f:
+            return f.read()
+
+    return None
+
+
+class StoryLayout:
+    """Stan składu na kanwie: pozycja kursora i numer strony oraz rysowanie treści opowiadania."""
+
+    def __init__(self, pdf, page_num=1, on_image_error=None):
+        self.pdf = pdf
+        self.page_num = page_num
+        self.y = PAGE_HEIGHT - MARGIN
+        # on_image_error(scene_num, wyjątek) – np. ostrzeżenie w interfejsie
+        self.on_image_error = on_image_error
+
+    def new_page(self):
+        """Nowa strona z numerem."""
+        self.pdf.showPage()
+        self.begin_page()
+
+    def begin_page(self):
+        """Numeruje stronę właśnie rozpoczętą na kanwie i ustawia kursor na jej górze."""
+        pdf = self.pdf
+        pdf.setFont("LiberationSerif", 12)
+        self.page_num += 1
+        self.y = PAGE_HEIGHT - MARGIN
+        pdf.setFont("LiberationSerif", 10)
+        pdf.drawCentredString(PAGE_WIDTH / 2, 30, f"Strona {self.page_num}")
+        pdf.setFont("LiberationSerif", 12)
+
+    def draw_image(self, img_bytes):
+        """Rysuje ilustrację rozdziału; obraz jest dekodowany tylko na czas rysowania."""
+        img_reader = ImageReader(io.BytesIO(img_bytes))
+        iw, ih = img_reader.getSize()
+        self.place_image(img_reader, iw, ih)
+
+    def place_image(self, img_reader, iw, ih):
+        """Umieszcza ilustrację o rozmiarze iw x ih pod kursorem (w razie potrzeby na nowej stronie)."""
+        pdf = self.pdf
+        max_w = TEXT_WIDTH * 0.7
+        scale = min(1.0, max_w / float(iw))
+        img_w = iw * scale
+        img_h = ih * scale
+
+        if self.y - img_h < MARGIN:
+            self.new_page()
+
+        x_center = (PAGE_WIDTH - img_w) / 2
+        pdf.drawImage(img_reader, x_center, self.y - img_h - 10,
+                      width=img_w, height=img_h)
+        self.y -= img_h + 30
+
+    def draw_story(self, story_text, images_data=None):
+        """Rysuje tekst opowiadania z nagłówkami rozdziałów i ich ilustracjami."""
+        pdf = self.pdf
+        lines = story_text.split("\n")
+        scene_num = 1
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                self.y -= 10
+                continue
+
+            # --- Tytuł rozdziału ---
+            if line.lower().startswith("rozdział"):
+            # oczyść markdown/cudzysłowy:
+                clean_title = re.sub(r'[*"_`#]+', '', line).strip()
+                pdf.setFont("LiberationSerif-Bold", 16)
+                pdf.drawString(MARGIN, self.y, clean_title)
+                self.y -= 18
+                pdf.setLineWidth(0.3)
+                pdf.line(MARGIN, self.y, MARGIN + 180, self.y)
+                self.y -= 25
+                pdf.setFont("LiberationSerif", 12)
+
+                # --- Ilustracja dla rozdziału ---
+                try:
+                    self.draw_scene_image(images_data, scene_num)
+                except Exception as e:
+                    if self.on_image_error:
+                        self.on_image_error(scene_num, e)
+
+                scene_num += 1
+
+            else:
+                # --- Tekst opowiadania ---
+                while len(line) > 0:
+                    text_line = line[:95]
+                    line = line[95:]
+                    pdf.drawString(MARGIN, self.y, text_line)
+                    self.y -= 15
+                    if self.y < 80:
+                        self.new_page()
+
+    def draw_scene_image(self, images_data, scene_num):
+        """Ilustracja rozdziału scene_num, jeśli jest w images_data."""
+        img_bytes = get_image_bytes(images_data, scene_num)
+        if img_bytes:
+            self.draw_image(img_bytes)
+
+    def draw_footer(self):
+        """Stopka na ostatniej stronie."""
+        self.pdf.setFont("LiberationSerif", 10)
+        self.pdf.drawCentredString(PAGE_WIDTH / 2, 40, f"Fabryka Opowiadań AI © {self.page_num} str.")
+
+
+STORY_TITLE = "✨ Opowiadanie stworzone przez Fabrykę Opowiadań AI ✨"
+
+
+def _draw_title_page(pdf, layout):
+    """Nagłówek pierwszej strony opowiadania."""
+    pdf.setFont("LiberationSerif-Bold", 22)
+    pdf.drawCentredString(PAGE_WIDTH / 2, layout.y, STORY_TITLE)
+    layout.y -= 30
+    pdf.setFont("LiberationSerif", 14)
+    layout.y -= 20
+
+    pdf.setLineWidth(0.5)
+    pdf.line(MARGIN, layout.y, PAGE_WIDTH - MARGIN, layout.y)
+    layout.y -= 50
+
+    pdf.setFont("LiberationSerif", 12)
+
+def render_story_pdf(story_text, images_data=None, on_image_error=None):
+    """Tworzy PDF jednego opowiadania w pamięci i zwraca go jako io.BytesIO."""
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    layout = StoryLayout(pdf, on_image_error=on_image_error)
+
+    # --- STRONA TYTUŁOWA ---
+    _draw_title_page(pdf, layout)
+
+    # --- Główna treść ---
+    layout.draw_story(story_text, images_data)
+
+    # --- Stopka na końcu ---
+    layout.draw_footer()
+
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+
+# --- Równoległy skład długich opowiadań (zakresy stron w puli procesów) ---
+def _noop(*args, **kwargs):
+    return None
+
+
+class _PageRangeCanvas:
+    """
+    Nakładka na kanwę, która przepuszcza rysowanie tylko dla stron z zakresu
+    [first, last]. Pozostałe strony są jedynie „składane” (liczy się pozycja
+    kursora i numer strony), więc układ jest identyczny jak przy pełnym składzie.
+    """
+
+    def __init__(self, pdf, first, last):
+        self._pdf = pdf
+        self.first = first
+        self.last = last
+        self.page = 1
+
+    def _visible(self):
+        return self.first <= self.page <= self.last
+
+    def showPage(self):
+        if self._visible():
+            self._pdf.showPage()
+        self.page += 1
+
+    def __getattr__(self, name):
+        if self._visible():
+            return getattr(self._pdf, name)
+        return _noop
+
+
+class _PlanningLayout(StoryLayout):
+    """
+    Przebieg składu bez rysowania (na _PageRangeCanvas bez stron widocznych):
+    pobiera każdą ilustrację raz i zapamiętuje jej rozmiar oraz stronę, na
+    której wypada.
+    """
+
+    def __init__(self, pdf, on_image_error=None):
+        super().__init__(pdf, on_image_error=on_image_error)
+        self.images = {}  # nr sceny -> (bajty, szerokość, wysokość, strona)
+
+    def draw_scene_image(self, images_data, scene_num):
+        img_bytes = get_image_bytes(images_data, scene_num)
+        if img_bytes:
+            iw, ih = ImageReader(io.BytesIO(img_bytes)).getSize()
+            self.place_image(None, iw, ih)
+            self.images[scene_num] = (img_bytes, iw, ih, self.page_num)
+
+
+class _RangeLayout(StoryLayout):
+    """
+    Skład zakresu stron w procesie roboczym: rozmiary ilustracji są znane
+    z przebiegu planującego, więc obrazy są dekodowane tylko dla stron z zakresu
+    (images zawiera wyłącznie te sceny).
+    """
+
+    def __init__(self, pdf, image_sizes, on_image_error=None):
+        super().__init__(pdf, on_image_error=on_image_error)
+        self.image_sizes = image_sizes  # nr sceny -> (szerokość, wysokość)
+
+    def draw_scene_image(self, images, scene_num):
+        if scene_num not in self.image_sizes:
+            return
+        iw, ih = self.image_sizes[scene_num]
+        img_bytes = images.get(scene_num)
+        self.place_image(ImageReader(io.BytesIO(img_bytes)) if img_bytes else None, iw, ih)
+
+
+def _plan_pages(story_text, images_data):
+    """
+    Przebieg planujący: zwraca liczbę stron, ilustracje {nr sceny: (bajty,
+    szerokość, wysokość, strona)} i sceny z błędami ilustracji.
+    """
+    errors = {}
+    pdf = _PageRangeCanvas(None, 0, 0)
+    layout = _PlanningLayout(pdf, on_image_error=lambda scene_num, e: errors.setdefault(scene_num, str(e)))
+    _draw_title_page(pdf, layout)
+    layout.draw_story(story_text, images_data)
+    return layout.page_num, layout.images, errors
+
+def _font_seed(story_text):
+    """Wszystkie znaki dokumentu w stałej kolejności (wspólne podzbiory czcionek we wszystkich częściach)."""
+    return "".join(sorted(set(story_text + STORY_TITLE + "Strona 0123456789 Fabryka Opowiadań AI © str.")))
+
+def _seed_font_subsets(pdf, seed):
+    """
+    Przypisuje znaki seed do podzbiorów czcionek kanwy przed rysowaniem. Te same
+    znaki w tej samej kolejności w każdej części -> identyczne podzbiory czcionek,
+    które przy scalaniu zostaną osadzone tylko raz.
+
+    ReportLab nie ma do tego publicznego API – korzystamy z wewnętrznych
+    TTFont.splitString(tekst, dokument), TTFont.getSubsetInternalName,
+    TTFont.state i Canvas._doc (sprawdzone z reportlab 4.2.2). Jeśli po
+    aktualizacji zachowują się inaczej, zgłaszamy błąd zamiast po cichu
+    osadzać w każdej części inne podzbiory.
+    """
+    try:
+        doc = pdf._doc
+        for font_name in ("LiberationSerif-Bold", "LiberationSerif"):
+            font = pdfmetrics.getFont(font_name)
+            font.splitString(seed, doc)
+            font.getSubsetInternalName(0, doc)
+            assigned = font.state[doc].assignments
+            missing = [c for c in seed if ord(c) in font.face.charToGlyph and ord(c) not in assigned]
+            if missing or font_name not in doc.fontMapping:
+                raise RuntimeError(f"znaki bez przypisanego podzbioru: {''.join(missing[:10])!r}")
+    except (AttributeError, KeyError, TypeError, RuntimeError) as e:
+        raise RuntimeError(
+            f"Nieobsługiwana wersja ReportLab ({reportlab.Version}) – nie da się przygotować "
+            f"wspólnych podzbiorów czcionek: {e}"
+        ) from e
+
+def _render_page_range(story_text, images, image_sizes, first, last):
+    """Składa strony [first, last] jako osobny PDF (uruchamiane w procesie roboczym)."""
+    errors = {}
+    buffer = io.BytesIO()
+    real_pdf = canvas.Canvas(buffer, pagesize=letter)
+
+    _seed_font_subsets(real_pdf, _font_seed(story_text))
+
+    pdf = _PageRangeCanvas(real_pdf, first, last)
+    layout = _RangeLayout(pdf, image_sizes, on_image_error=lambda scene_num, e: errors.setdefault(scene_num, str(e)))
+    _draw_title_page(pdf, layout)
+    layout.draw_story(story_text, images)
+    layout.draw_footer()
+
+    real_pdf.save()
+    return buffer.getvalue(), errors
+
+def render_story_pdf_parallel(story_text, images_data=None, workers=None, on_image_error=None):
+    """
+    Wersja render_story_pdf dla długich dokumentów: zakresy stron są składane
+    równolegle w puli procesów, a części scalane w jeden PDF. Numeracja stron
+    i stopka są takie same jak przy składzie w jednym procesie.
+
+    Ilustracje są pobierane raz, w przebiegu planującym; każdy zakres dostaje
+    tylko obrazy ze swoich stron (i rozmiary pozostałych, potrzebne do układu).
+    """
+    workers = workers or os.cpu_count() or 1
+    total_pages, planned, errors = _plan_pages(story_text, images_data)
+    image_sizes = {scene_num: (iw, ih) for scene_num, (_, iw, ih, _) in planned.items()}
+
+    # Więcej zakresów niż procesów wyrównuje obciążenie (strony z ilustracjami są droższe)
+    chunks = min(total_pages, workers * 2)
+    bounds = [round(i * total_pages / chunks) for i in range(chunks + 1)]
+    ranges = [(bounds[i] + 1, bounds[i + 1]) for i in range(chunks)]
+
+    # "spawn" zamiast "fork" – proces serwera (np. Streamlit) jest wielowątkowy
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+        for first, last in ranges:
+            images = {
+                scene_num: img_bytes
+                for scene_num, (img_bytes, _, _, page) in planned.items()
+                if first <= page <= last
+            }
+            futures.append(pool.submit(_render_page_range, story_text, images, image_sizes, first, last))
+        parts = [f.result() for f in futures]
+
+    writer = PdfWriter()
+    for part_bytes, part_errors in parts:
+        writer.append(PdfReader(io.BytesIO(part_bytes)))
+        for scene_num, message in part_errors.items():
+            errors.setdefault(scene_num, message)
+    # Każdy przebieg scala jeden poziom odwołań: plik czcionki -> deskryptor -> słownik czcionki
+    for _ in range(3):
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+    if on_image_error:
+        for scene_num, message in sorted(errors.items()):
+            on_image_error(scene_num, message)
+
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def _fit_string(pdf, text, font, size, max_width):
+    """Skraca tekst tak, aby zmieścił się w podanej szerokości."""
+    if pdf.stringWidth(text, font, size) <= max_width:
+        return text
+    while text and pdf.stringWidth(text + "…", font, size) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+def _story_text(entry):
+    """Tekst opowiadania z wpisu antologii – wczytywany z pliku dopiero, gdy jest potrzebny."""
+    if entry.get("story_file"):
+        with open(entry["story_file"], "r", encoding="utf-8") as f:
+            return f.read()
+    return entry.get("story", "")
+
+def _remap_object(obj, new_ref):
+    """Kopia obiektu PDF z odwołaniami przenumerowanymi przez new_ref(stary_numer)."""
+    if isinstance(obj, IndirectObject):
+        return IndirectObject(new_ref(obj.idnum), 0, None)
+    if isinstance(obj, StreamObject):
+        copy = obj.__class__()
+        copy.update({key: _remap_object(value, new_ref) for key, value in obj.items()})
+        copy._data = obj._data  # dane strumienia bez dekodowania (zakodowane jak w części)
+        return copy
+    if isinstance(obj, DictionaryObject):
+        return DictionaryObject({key: _remap_object(value, new_ref) for key, value in obj.items()})
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_remap_object(value, new_ref) for value in obj)
+    return obj
+
+def _serialize(obj):
+    data = io.BytesIO()
+    obj.write_to_stream(data)
+    return data.getvalue()
+
+def _merge_pdf_parts(part_paths, output_path, outline=(), title=None):
+    """
+    Scala pliki PDF w jeden, strumieniowo: obiekty każdej części są od razu
+    przepisywane do pliku wynikowego pod nowymi numerami, więc w pamięci jest
+    naraz tylko jedna część. Obiekty o identycznej treści (np. te same podzbiory
+    czcionek w każdej części) są zapisywane raz. outline: lista (tytuł, indeks_strony).
+    """
+    # Numery 1–3 są zarezerwowane: katalog, drzewo stron, korzeń zakładek
+    catalog_num, pages_num, outline_num = 1, 2, 3
+    next_num = outline_num + 1
+    offsets = {}
+    written = {}  # skrót treści obiektu -> numer w pliku wynikowym
+    kids = []
+
+    def allocate():
+        nonlocal next_num
+        next_num += 1
+        return next_num - 1
+
+    with open(output_path, "wb") as out:
+        def write_object(num, obj, data=None):
+            if data is None:
+                data = _serialize(obj)
+            offsets[num] = out.tell()
+            out.write(f"{num} 0 obj\n".encode("ascii"))
+            out.write(data)
+            out.write(b"\nendobj\n")
+
+        def copy_part(path):
+            """Przepisuje strony jednej części (i wszystko, do czego się odwołują); zwraca odwołania do stron."""
+            reader = PdfReader(path)
+            page_nums = {page.indirect_reference.idnum for page in reader.pages}
+            mapping, visiting = {}, set()
+
+            def copy(old_num):
+                if old_num in mapping:
+                    return mapping[old_num]
+                if old_num in visiting:
+                    # Cykl odwołań – numer nadajemy od razu, bez szukania duplikatu
+                    mapping[old_num] = allocate()
+                    return mapping[old_num]
+                visiting.add(old_num)
+                obj = reader.get_object(old_num)
+                if old_num in page_nums:
+                    # Strony wskazują na nowe, wspólne drzewo stron
+                    obj = DictionaryObject({key: value for key, value in obj.items() if key != "/Parent"})
+                    obj[NameObject("/Parent")] = IndirectObject(pages_num, 0, None)
+                # Najpierw obiekty, do których się odwołuje – ich nowe numery są częścią treści
+                new_obj = _remap_object(obj, copy)
+                visiting.discard(old_num)
+
+                data = _serialize(new_obj)
+                if old_num in mapping or old_num in page_nums:
+                    num = mapping.get(old_num) or allocate()
+                    write_object(num, new_obj, data)
+                else:
+                    key = hashlib.blake2b(data, digest_size=16).digest()
+                    num = written.get(key)
+                    if num is None:
+                        num = written[key] = allocate()
+                        write_object(num, new_obj, data)
+                mapping[old_num] = num
+                return num
+
+            return [IndirectObject(copy(page.indirect_reference.idnum), 0, None) for page in reader.pages]
+
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        for path in part_paths:
+            kids.extend(copy_part(path))
+            # Obiekty czytnika tworzą cykle odwołań – zwalniamy część od razu, zanim weźmiemy następną
+            gc.collect()
+
+        write_object(pages_num, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(kids),
+            NameObject("/Count"): NumberObject(len(kids)),
+        }))
+
+        # Zakładki (jeden poziom)
+        item_nums = [allocate() for _ in outline]
+        for k, (item_title, page_index) in enumerate(outline):
+            item = DictionaryObject({
+                NameObject("/Title"): TextStringObject(item_title),
+                NameObject("/Parent"): IndirectObject(outline_num, 0, None),
+                NameObject("/Dest"): ArrayObject([kids[page_index], NameObject("/Fit")]),
+            })
+            if k > 0:
+                item[NameObject("/Prev")] = IndirectObject(item_nums[k - 1], 0, None)
+            if k + 1 < len(item_nums):
+                item[NameObject("/Next")] = IndirectObject(item_nums[k + 1], 0, None)
+            write_object(item_nums[k], item)
+        outline_root = DictionaryObject({NameObject("/Type"): NameObject("/Outlines"), NameObject("/Count"): NumberObject(len(item_nums))})
+        if item_nums:
+            outline_root[NameObject("/First")] = IndirectObject(item_nums[0], 0, None)
+            outline_root[NameObject("/Last")] = IndirectObject(item_nums[-1], 0, None)
+        write_object(outline_num, outline_root)
+
+        write_object(catalog_num, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(pages_num, 0, None),
+            NameObject("/Outlines"): IndirectObject(outline_num, 0, None),
+        }))
+        trailer = DictionaryObject({NameObject("/Root"): IndirectObject(catalog_num, 0, None)})
+        if title:
+            info_num = allocate()
+            write_object(info_num, DictionaryObject({NameObject("/Title"): TextStringObject(title)}))
+            trailer[NameObject("/Info")] = IndirectObject(info_num, 0, None)
+        trailer[NameObject("/Size")] = NumberObject(next_num)
+
+        xref_offset = out.tell()
+        out.write(f"xref\n0 {next_num}\n0000000000 65535 f \n".encode("ascii"))
+        for num in range(1, next_num):
+            out.write(f"{offsets[num]:010d} 00000 n \n".encode("ascii"))
+        out.write(b"trailer\n")
+        trailer.write_to_stream(out)
+        out.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+
+def _render_anthology_story(entry, path, first_page, last_story, seed, on_image_error=None):
+    """Składa jedno opowiadanie antologii do osobnego pliku, numerując strony od first_page."""
+    pdf = canvas.Canvas(path, pagesize=letter, pageCompression=1)
+    _seed_font_subsets(pdf, seed)
+    layout = StoryLayout(pdf, page_num=first_page - 1, on_image_error=on_image_error)
+    layout.begin_page()
+
+    pdf.setFont("LiberationSerif-Bold", 20)
+    pdf.drawCentredString(PAGE_WIDTH / 2, layout.y, _fit_string(pdf, entry.get("title", ""), "LiberationSerif-Bold", 20, TEXT_WIDTH))
+    layout.y -= 50
+    pdf.setFont("LiberationSerif", 12)
+
+    layout.draw_story(_story_text(entry), entry.get("images"))
+    if last_story:
+        layout.draw_footer()
+
+    pdf.save()
+    return layout.page_num
+
+def _render_anthology_front(stories, path, title, start_pages, seed):
+    """Strona tytułowa i spis treści z gotowymi numerami stron."""
+    pdf = canvas.Canvas(path, pagesize=letter, pageCompression=1)
+    _seed_font_subsets(pdf, seed)
+    layout = StoryLayout(pdf)
+
+    # --- STRONA TYTUŁOWA ---
+    pdf.setFont("LiberationSerif-Bold", 22)
+    pdf.drawCentredString(PAGE_WIDTH / 2, layout.y, _fit_string(pdf, title, "LiberationSerif-Bold", 22, TEXT_WIDTH))
+    layout.y -= 30
+    pdf.setFont("LiberationSerif", 14)
+    pdf.drawCentredString(PAGE_WIDTH / 2, layout.y, f"Liczba opowiadań: {len(stories)}")
+    layout.y -= 20
+
+    pdf.setLineWidth(0.5)
+    pdf.line(MARGIN, layout.y, PAGE_WIDTH - MARGIN, layout.y)
+
+    # --- SPIS TREŚCI ---
+    for i, entry in enumerate(stories):
+        if i % TOC_ENTRIES_PER_PAGE == 0:
+            layout.new_page()
+            pdf.setFont("LiberationSerif-Bold", 18)
+            pdf.drawString(MARGIN, layout.y, "Spis treści")
+            layout.y -= 40
+            pdf.setFont("LiberationSerif", 12)
+
+        entry_title = _fit_string(pdf, f"{i + 1}. {entry.get('title', '')}", "LiberationSerif", 12, TEXT_WIDTH - 50)
+        pdf.drawString(MARGIN, layout.y, entry_title)
+        pdf.drawRightString(PAGE_WIDTH - MARGIN, layout.y, str(start_pages[i]))
+        layout.y -= 20
+
+    if not stories:
+        layout.draw_footer()
+
+    pdf.save()
+    return layout.page_num
+
+def create_anthology_pdf(stories, output_path, title="Antologia Fabryki Opowiadań AI", on_image_error=None):
+    """
+    Składa wiele opowiadań w jeden PDF ze spisem treści i ciągłą numeracją stron.
+
+    stories: lista wpisów {"title", "story" lub "story_file", "images": {nr_sceny: obraz}},
+    gdzie obraz to ścieżka do pliku, URL albo bajty. Każde opowiadanie jest składane
+    do osobnego pliku tymczasowego (tekst i ilustracje wczytywane dopiero wtedy),
+    a części są scalane strumieniowo do output_path – zużycie pamięci zależy od
+    najdłuższego opowiadania, nie od całej antologii.
+    """
+    # Strona tytułowa + strony spisu treści – znane z góry, więc opowiadania
+    # można składać od razu z właściwymi numerami stron
+    front_pages = 1 + -(-len(stories) // TOC_ENTRIES_PER_PAGE)
+
+    # Wspólne podzbiory czcionek we wszystkich częściach (osadzone w wyniku raz)
+    chars = set(title + "Spis treści Liczba opowiadań: …")
+    for entry in stories:
+        chars.update(entry.get("title", ""))
+        chars.update(_story_text(entry))
+    seed = _font_seed("".join(chars))
+
+    with tempfile.TemporaryDirectory(prefix="antologia_") as tmp:
+        story_paths, start_pages = [], []
+        page = front_pages
+        for i, entry in enumerate(stories):
+            path = os.path.join(tmp, f"story_{i}.pdf")
+            start_pages.append(page + 1)
+            page = _render_anthology_story(entry, path, page + 1, i == len(stories) - 1, seed, on_image_error)
+            story_paths.append(path)
+
+        front_path = os.path.join(tmp, "front.pdf")
+        _render_anthology_front(stories, front_path, title, start_pages, seed)
+
+        outline = [
+            (entry.get("title", f"Opowiadanie {i + 1}"), start - 1)
+            for i, (entry, start) in enumerate(zip(stories, start_pages))
+        ]
+        _merge_pdf_parts([front_path] + story_paths, output_path, outline, title)
+
+    return output_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Użycie: python pdf_export.py antologia.json wynik.pdf")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    create_anthology_pdf(
+        entries,
+        sys.argv[2],
+        on_image_error=lambda scene_num, e: print(f"⚠️ Nie udało się dodać ilustracji dla rozdziału {scene_num}: {e}")
+    )
+    print(f"✅ Zapisano antologię ({len(entries)} opowiadań): {sys.argv[2]}")
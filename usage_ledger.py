@@ -0,0 +1,176 @@
+"""
+Trwały rejestr zużycia API (tokeny, ilustracje, czas odpowiedzi, koszt) wspólny
+dla wszystkich sesji – w odróżnieniu od liczników w st.session_state nie znika
+po wylogowaniu ani po rozpoczęciu nowego opowiadania.
+
+Wpisy są tylko dopisywane do lokalnej bazy SQLite (tryb WAL). record() jedynie
+wrzuca wpis do kolejki, a zapis partiami robi wątek w tle, więc rejestr nie
+wydłuża generowania. Raport zbiorczy:
+
+    python usage_ledger.py --by day,model --since 2026-10-01
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import socket
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_DB = os.environ.get("FABRYKA_USAGE_DB", "fabryka_usage.db")
+DEPLOYMENT = os.environ.get("FABRYKA_DEPLOYMENT", socket.gethostname())
+
+# Wymiary, po których można grupować raport (lista dozwolonych kolumn SQL)
+ROLLUP_DIMENSIONS = ("day", "model", "stage", "deployment")
+
+_STOP = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    deployment TEXT NOT NULL,
+    session_id TEXT,
+    model TEXT,
+    stage TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL,
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_usage_day_model ON usage (day, model, stage);
+CREATE INDEX IF NOT EXISTS idx_usage_model_day ON usage (model, day);
+CREATE INDEX IF NOT EXISTS idx_usage_deployment_day ON usage (deployment, day);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class UsageLedger:
+    """Dopisywany rejestr zużycia z zapisem partiami w wątku w tle."""
+
+    def __init__(self, path=DEFAULT_DB, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+
+        conn = _connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._run, name="usage-ledger-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def record(self, stage, model=None, prompt_tokens=0, completion_tokens=0, images=0,
+               latency_ms=None, cost_usd=0.0, session_id=None, deployment=None):
+        """Dodaje wpis do kolejki zapisu (nie blokuje, nie dotyka bazy)."""
+        now = time.time()
+        self._queue.put((
+            now, time.strftime("%Y-%m-%d", time.gmtime(now)), deployment or DEPLOYMENT, session_id,
+            model, stage, prompt_tokens, completion_tokens, images, latency_ms, cost_usd
+        ))
+
+    def _run(self):
+        conn = _connect(self.path)
+        stopping = False
+        while not stopping:
+            # Czekamy na pierwszy wpis, a potem zbieramy wszystko, co czeka w kolejce
+            item = self._queue.get()
+            batch = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO usage (ts, day, deployment, session_id, model, stage, prompt_tokens, "
+                            "completion_tokens, images, latency_ms, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            batch
+                        )
+                except sqlite3.Error as e:
+                    print(f"⚠️ Nie udało się zapisać {len(batch)} wpisów rejestru zużycia: {e}", file=sys.stderr)
+        conn.close()
+
+    def close(self, timeout=5.0):
+        """Zapisuje zaległe wpisy i kończy wątek zapisu."""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join(timeout)
+
+
+def rollup(path=DEFAULT_DB, by=("day", "model"), since=None, until=None):
+    """
+    Zestawienie zbiorcze pogrupowane po wybranych wymiarach (ROLLUP_DIMENSIONS),
+    opcjonalnie zawężone do dni [since, until] w formacie RRRR-MM-DD.
+    Zwraca listę słowników.
+    """
+    by = tuple(by)
+    unknown = [d for d in by if d not in ROLLUP_DIMENSIONS]
+    if not by or unknown:
+        raise ValueError(f"Nieznany wymiar raportu: {unknown or by}. Dostępne: {', '.join(ROLLUP_DIMENSIONS)}")
+
+    cols = ", ".join(by)
+    sql = (
+        f"SELECT {cols}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(images), "
+        f"SUM(cost_usd), AVG(latency_ms) FROM usage WHERE day >= ? AND day <= ? "
+        f"GROUP BY {cols} ORDER BY {cols}"
+    )
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(sql, (since or "0000-00-00", until or "9999-99-99")).fetchall()
+    finally:
+        conn.close()
+
+    keys = by + ("calls", "prompt_tokens", "completion_tokens", "images", "cost_usd", "avg_latency_ms")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raport zbiorczy z rejestru zużycia Fabryki Opowiadań.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="ścieżka do bazy rejestru")
+    parser.add_argument("--by", default="day,model", help=f"wymiary grupowania: {','.join(ROLLUP_DIMENSIONS)}")
+    parser.add_argument("--since", help="od dnia (RRRR-MM-DD)")
+    parser.add_argument("--until", help="do dnia (RRRR-MM-DD)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Brak bazy rejestru: {args.db}")
+        sys.exit(1)
+
+    dims = tuple(d.strip() for d in args.by.split(",") if d.strip())
+    try:
+        report = rollup(args.db, dims, args.since, args.until)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    header = [f"{d:<20}" for d in dims] + [f"{'wywołania':>10}", f"{'tokeny wej.':>12}", f"{'tokeny wyj.':>12}",
+                                           f"{'ilustracje':>10}", f"{'koszt USD':>10}", f"{'śr. ms':>8}"]
+    print(" ".join(header))
+    for row in report:
+        cells = [f"{str(row[d]):<20}" for d in dims] + [
+            f"{row['calls']:>10}", f"{row['prompt_tokens']:>12}", f"{row['completion_tokens']:>12}",
+            f"{row['images']:>10}", f"{row['cost_usd']:>10.4f}", f"{(row['avg_latency_ms'] or 0):>8.0f}"
+        ]
+        print(" ".join(cells))
+    total = sum(row["cost_usd"] for row in report)
+    print(f"\nRazem: {sum(row['calls'] for row in report)} wywołań, {total:.4f} USD")